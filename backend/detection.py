@@ -1,81 +1,178 @@
 from ultralytics import YOLO
 import cv2
 import numpy as np
+import logging
+import os
+import torch
+from typing import Any, Dict, List, Tuple
+
+from detection_utils import filter_target_boxes
+
+log = logging.getLogger(__name__)
+
+# (found, annotated_frame, detections) as returned by the detectors
+DetectionResult = Tuple[bool, np.ndarray, List[Dict[str, Any]]]
+
+# Let cuDNN benchmark and keep the fastest conv algorithms. It does this once per
+# input shape; the image size is fixed but the batch holds 1-4 changed lanes, so
+# every batch size is warmed up at load time (see main.load_detector).
+torch.backends.cudnn.benchmark = True
+
+# INT8 calibration dataset (frames sampled from uploads/). Used only if present.
+CALIBRATION_DATA = "calib.yaml"
+
+def load_model(model_path: str, imgsz: int = 640) -> YOLO:
+    """
+    Load a YOLO model, preferring an optimized export next to the .pt weights:
+    a TensorRT engine (FP16, or INT8 when calibration data exists) on GPU
+    machines, an OpenVINO model otherwise. The export is made once per imgsz
+    and reused on later startups. Falls back to the PyTorch weights if the
+    export fails.
+    """
+    # Exports are built for one input size, so it is part of their name
+    stem = f"{os.path.splitext(model_path)[0]}_{imgsz}"
+    if torch.cuda.is_available():
+        export_path = stem + ".engine"
+        export_args = dict(format="engine", half=True, imgsz=imgsz, dynamic=True, batch=4, simplify=True)
+        if os.path.exists(CALIBRATION_DATA):
+            export_args.update(int8=True, data=CALIBRATION_DATA)
+    else:
+        # CPU-only: OpenVINO runs noticeably faster than PyTorch on Intel/AMD CPUs
+        export_path = stem + "_openvino_model"
+        export_args = dict(format="openvino", imgsz=imgsz, dynamic=True)
+
+    if not os.path.exists(export_path) and os.path.exists(model_path):
+        try:
+            print(f"Exporting {model_path} to {export_args['format']} (one-time)...")
+            # Ultralytics names the export after the weights alone; move it to the sized name
+            exported = YOLO(model_path).export(**export_args)
+            os.replace(exported, export_path)
+        except Exception as e:
+            print(f"⚠️ Warning: {export_args['format']} export failed ({e}), using {model_path}")
+
+    if os.path.exists(export_path):
+        return YOLO(export_path, task="detect")
+    model = YOLO(model_path)
+    if torch.cuda.is_available():
+        _optimize_torch_model(model)
+    return model
+
+def _optimize_torch_model(model: YOLO):
+    """Speed up PyTorch (non-exported) inference on GPU: fused conv+bn, NHWC layout, compiled forward."""
+    # Fuse now so the predictor doesn't re-fuse later and drop the layout/compiled forward
+    model.fuse()
+    net = model.model.to(memory_format=torch.channels_last)
+    if hasattr(torch, "compile"):
+        try:
+            # Compile forward in place: the predictor keeps this module object.
+            # dynamic=True: the batch size varies between ticks, which would force
+            # a recompile (and CUDA graph re-capture with "reduce-overhead") per size.
+            net.forward = torch.compile(net.forward, dynamic=True)
+        except Exception as e:
+            print(f"⚠️ Warning: torch.compile unavailable ({e}), running eagerly")
+
+def _class_ids(names_lower: Dict[int, str], is_target) -> np.ndarray:
+    """Return the class IDs whose (lowercased) name satisfies is_target."""
+    target_ids = frozenset(i for i, n in names_lower.items() if is_target(n))
+    return np.fromiter(sorted(target_ids), dtype=np.int32, count=len(target_ids))
+
+def _split_boxes(data: np.ndarray):
+    """Split Boxes.data rows (x1, y1, x2, y2, [track_id,] conf, cls) into cls, conf, xyxy arrays."""
+    return data[:, -1].astype(np.int32), data[:, -2], data[:, :4].astype(np.int32)
+
+def _label_sizes(names_lower: Dict[int, str], class_ids: np.ndarray, prefix: str) -> Dict[int, tuple]:
+    """
+    Pre-measure the box label of each target class. Labels only differ in the
+    "0.00" confidence suffix, which is close enough in width to measure once.
+    """
+    return {
+        i: cv2.getTextSize(f"{prefix}{names_lower[i].upper()} 0.00", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+        for i in class_ids.tolist()
+    }
 
 class EmergencyDetector:
-    def __init__(self, model_path: str = "best.pt"):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path: str = "best.pt", imgsz: int = 320, half: bool = True):
+        # Inference input size; frames are letterboxed to imgsz instead of the default 640.
+        # Lightbars, logos and markings are high-contrast, so 320 is usually enough.
+        self.imgsz = imgsz
+        # FP16 inference on GPU (ignored on CPU)
+        self.half = half
+        self.model = load_model(model_path, imgsz)
         # Target classes (names as per the custom model)
         # Target classes as per best.pt labels
         self.target_classes = {
             'amb_body_all', 'amb_logo', 'amb_plus', 'amb_text',
             'fire_ladder', 'fire_symbol', 'fire_text', 'fire_truck', 'siren'
         }
+        # Lowercased class names and target class IDs, computed once per model
+        self._names_lower = {i: n.lower() for i, n in self.model.names.items()}
+        self._target_ids = _class_ids(self._names_lower, lambda name: name in self.target_classes)
+        self._label_sizes = _label_sizes(self._names_lower, self._target_ids, "")
 
     def detect(self, frame: np.ndarray, conf_threshold: float = 0.5):
         """
-        Run inference on a frame.
+        Run inference on a frame. Boxes are drawn onto a copy of the frame.
         Returns:
             has_emergency (bool): True if emergency vehicle detected.
             annotated_frame (np.ndarray): Frame with bounding boxes drawn.
         """
-        # Resize for performance (optional, YOLOv8 handles it, but explicit consistency is good)
-        # frame_resized = cv2.resize(frame, (640, 480)) 
-        
-        results = self.model(frame, conf=conf_threshold, verbose=False)
-        result = results[0]
-        
-        has_emergency = False
-        detections = []
-        
-        # Check detections
-        for box in result.boxes:
-            cls_id = int(box.cls[0])
-            conf = float(box.conf[0])
-            class_name = result.names[cls_id].lower()
-            
-            # Store all detections for display
-            detections.append({
-                "class": class_name,
-                "confidence": round(conf, 2)
-            })
-            
-            print(f"Detected: {class_name} with confidence {conf:.2f}")
-            
-            if class_name in self.target_classes:
-                has_emergency = True
-                print(f"ALERT: Emergency vehicle ({class_name}) confirmed!")
+        return self.detect_batch([frame], conf_threshold)[0]
+
+    def detect_batch(self, frames: List[np.ndarray], conf_threshold: float = 0.5) -> List[DetectionResult]:
+        """
+        Run inference on several frames (one per lane) in a single forward pass.
+        Returns a list of (has_emergency, annotated_frame, detections), one per frame.
+        """
+        if not frames:
+            return []
+        with torch.inference_mode():
+            results = self.model(frames, conf=conf_threshold, imgsz=self.imgsz, half=self.half, verbose=False)
+        return [self._process_result(frame, result, conf_threshold) for frame, result in zip(frames, results)]
+
+    def _process_result(self, frame: np.ndarray, result, conf_threshold: float) -> DetectionResult:
+        # All boxes are listed in detections, so copy the box data off the
+        # device in a single transfer (one sync) and split it on the host
+        cls, conf, xyxy = _split_boxes(result.boxes.data.cpu().numpy())
+
+        # Store all detections for display
+        detections = [
+            {"class": self._names_lower[c], "confidence": round(p, 2)}
+            for c, p in zip(cls.tolist(), conf.tolist())
+        ]
+
+        # Boxes to draw, collected in the same pass that finds the targets
+        keep = filter_target_boxes(cls, conf, np.float32(conf_threshold), self._target_ids)
+        target_draws = list(zip(xyxy[keep].tolist(), cls[keep].tolist(), conf[keep].tolist()))
+        has_emergency = bool(target_draws)
         
         if has_emergency:
-            # Draw custom GREEN boxes for emergency vehicles
+            log.debug("Emergency vehicle confirmed: %s", detections)
+            # Draw custom GREEN boxes for emergency vehicles. Lane frames are
+            # shared with VideoManager and the MJPEG encoder, so draw on a copy.
             annotated_frame = frame.copy()
-            for box in result.boxes:
-                cls_id = int(box.cls[0])
-                class_name = result.names[cls_id].lower()
+            for (x1, y1, x2, y2), cls_id, score in target_draws:
+                # Draw Green Rectangle (BGR: 0, 255, 0)
+                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 255, 0), 3)
                 
-                if class_name in self.target_classes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    # Draw Green Rectangle (BGR: 0, 255, 0)
-                    cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 255, 0), 3)
-                    
-                    # Add Label
-                    label = f"{class_name.upper()} {float(box.conf[0]):.2f}"
-                    (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                    cv2.rectangle(annotated_frame, (x1, y1 - 20), (x1 + w, y1), (0, 255, 0), -1)
-                    cv2.putText(annotated_frame, label, (x1, y1 - 5), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+                # Add Label
+                label = f"{self._names_lower[cls_id].upper()} {score:.2f}"
+                w, h = self._label_sizes[cls_id]
+                cv2.rectangle(annotated_frame, (x1, y1 - 20), (x1 + w, y1), (0, 255, 0), -1)
+                cv2.putText(annotated_frame, label, (x1, y1 - 5), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
         else:
-            # If no emergency, just use default plot or raw frame?
-            # Default plot is fine for other objects, but user cares about emergency
-            annotated_frame = result.plot()
+            # Only emergency annotations are displayed, so pass the raw frame through
+            annotated_frame = frame
         
         return has_emergency, annotated_frame, detections
 
 class AccidentDetector:
-    def __init__(self, model_path: str = "accident.pt"):
+    def __init__(self, model_path: str = "accident.pt", imgsz: int = 416, half: bool = True):
+        self.imgsz = imgsz
+        self.half = half
         # Load model if it exists, otherwise we'll handle gracefully
         try:
-            self.model = YOLO(model_path)
+            self.model = load_model(model_path, imgsz)
             self.model_loaded = True
             print(f"✅ Accident Detection Model ({model_path}) loaded successfully!")
         except Exception as e:
@@ -88,52 +185,61 @@ class AccidentDetector:
         self.target_classes = {
             'accident', 'crash', 'fire', 'overturned vehicle', 'collision', 'car_crash'
         }
+        if self.model_loaded:
+            self._names_lower = {i: n.lower() for i, n in self.model.names.items()}
+            self._target_ids = _class_ids(
+                self._names_lower, lambda name: name in self.target_classes or 'accident' in name
+            )
+            self._label_sizes = _label_sizes(self._names_lower, self._target_ids, "ACCIDENT: ")
+            self._target_ids_t = None  # _target_ids on the model's device, set on first detect
 
     def detect(self, frame: np.ndarray, conf_threshold: float = 0.5):
         """
-        Run accident detection on a frame.
+        Run accident detection on a frame. Boxes are drawn onto a copy of the frame.
+        """
+        return self.detect_batch([frame], conf_threshold)[0]
+
+    def detect_batch(self, frames: List[np.ndarray], conf_threshold: float = 0.5) -> List[DetectionResult]:
+        """
+        Run accident detection on several frames in a single forward pass.
+        Returns a list of (has_accident, annotated_frame, detections), one per frame.
         """
         if not self.model_loaded:
-            return False, frame, []
-            
-        results = self.model(frame, conf=conf_threshold, verbose=False)
-        result = results[0]
-        
-        has_accident = False
-        detections = []
-        
-        for box in result.boxes:
-            cls_id = int(box.cls[0])
-            conf = float(box.conf[0])
-            class_name = result.names[cls_id].lower()
-            
-            # Filter for specific accident classes in case the model detects other things too
-            if class_name in self.target_classes or 'accident' in class_name:
-                detections.append({
-                    "class": class_name,
-                    "confidence": round(conf, 2)
-                })
-                
-                print(f"🚨 DETECTED ACCIDENT: {class_name} ({conf:.2f})")
-                has_accident = True
+            return [(False, frame, []) for frame in frames]
+        if not frames:
+            return []
+        with torch.inference_mode():
+            results = self.model(frames, conf=conf_threshold, imgsz=self.imgsz, half=self.half, verbose=False)
+        return [self._process_result(frame, result) for frame, result in zip(frames, results)]
+
+    def _process_result(self, frame: np.ndarray, result) -> DetectionResult:
+        # Filter for specific accident classes in case the model detects other things too.
+        # Done on the boxes' device so only the (usually empty) matches are copied back.
+        boxes = result.boxes.data
+        if self._target_ids_t is None or self._target_ids_t.device != boxes.device:
+            self._target_ids_t = torch.from_numpy(self._target_ids).to(boxes.device)
+        keep = torch.isin(boxes[:, -1].int(), self._target_ids_t)
+        cls, conf, xyxy = _split_boxes(boxes[keep].cpu().numpy())
+        target_draws = list(zip(xyxy.tolist(), cls.tolist(), conf.tolist()))
+        has_accident = bool(target_draws)
+        detections = [
+            {"class": self._names_lower[cls_id], "confidence": round(score, 2)}
+            for _, cls_id, score in target_draws
+        ]
         
         annotated_frame = frame
         if has_accident:
-            # Draw RED/ORANGE boxes for accidents
+            log.debug("Accident detected: %s", detections)
+            # Draw RED/ORANGE boxes for accidents (on a copy, see EmergencyDetector)
             annotated_frame = frame.copy()
-            for box in result.boxes:
-                cls_id = int(box.cls[0])
-                class_name = result.names[cls_id].lower()
+            for (x1, y1, x2, y2), cls_id, score in target_draws:
+                # Draw Orange Rectangle (BGR: 0, 165, 255)
+                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 165, 255), 3)
                 
-                if class_name in self.target_classes or 'accident' in class_name:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    # Draw Orange Rectangle (BGR: 0, 165, 255)
-                    cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 165, 255), 3)
-                    
-                    label = f"ACCIDENT: {class_name.upper()} {float(box.conf[0]):.2f}"
-                    (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                    cv2.rectangle(annotated_frame, (x1, y1 - 20), (x1 + w, y1), (0, 165, 255), -1)
-                    cv2.putText(annotated_frame, label, (x1, y1 - 5), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                label = f"ACCIDENT: {self._names_lower[cls_id].upper()} {score:.2f}"
+                w, h = self._label_sizes[cls_id]
+                cv2.rectangle(annotated_frame, (x1, y1 - 20), (x1 + w, y1), (0, 165, 255), -1)
+                cv2.putText(annotated_frame, label, (x1, y1 - 5), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
                                 
         return has_accident, annotated_frame, detections
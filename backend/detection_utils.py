@@ -0,0 +1,34 @@
+import numpy as np
+
+# Numba is optional: without it the same filter runs as vectorized NumPy
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def filter_target_boxes(classes, scores, conf_thresh, target_ids):
+        """
+        Return the indices of boxes whose class is in target_ids (sorted int32)
+        and whose score is at least conf_thresh.
+        """
+        keep = np.empty(classes.shape[0], dtype=np.int32)
+        n = 0
+        for i in range(classes.shape[0]):
+            if scores[i] < conf_thresh:
+                continue
+            j = np.searchsorted(target_ids, classes[i])
+            if j < target_ids.shape[0] and target_ids[j] == classes[i]:
+                keep[n] = i
+                n += 1
+        return keep[:n]
+else:
+    def filter_target_boxes(classes, scores, conf_thresh, target_ids):
+        """
+        Return the indices of boxes whose class is in target_ids (sorted int32)
+        and whose score is at least conf_thresh.
+        """
+        mask = (scores >= conf_thresh) & np.isin(classes, target_ids)
+        return np.flatnonzero(mask).astype(np.int32)
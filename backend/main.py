@@ -4,17 +4,40 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import cv2
 import asyncio
+import atexit
+import io
 import json
+import logging
+import logging.handlers
+import queue
 import time
 import os
 import shutil
+import threading
 import numpy as np
-from typing import List, Dict
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Set
 
 from traffic_control import TrafficController
 from detection import EmergencyDetector
 from stream import VideoManager
 
+# Log records are handed to a queue and written out by a listener thread, so
+# logging from the event loop (e.g. traffic signal switches) never blocks on stdout
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+# Lives as long as the process (not one lifespan); write out queued records at exit
+atexit.register(_log_listener.stop)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# Pass the message through as is; the listener's handler applies the real format
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+log = logging.getLogger(__name__)
+
 # Ensure uploads directory exists
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -26,10 +49,84 @@ video_staging = {1: None, 2: None, 3: None, 4: None}
 # Global instances (initialized as None, created on /simulation/start)
 video_manager = None
 traffic_controller = None
-detector = EmergencyDetector()  # Loads best.pt
 
-latest_processed_frames = {}
-latest_detections = {}  # Store detection info per lane
+# Inference runs on one dedicated thread so the model's CUDA context stays on it
+inference_executor = ThreadPoolExecutor(max_workers=1)
+
+# JPEG encoding for the MJPEG streams runs on this pool to keep the event loop free
+encode_pool = ThreadPoolExecutor(max_workers=4)
+JPEG_QUALITY = 75
+# Baseline (non-progressive), no Huffman optimization pass: fastest encode for streaming
+JPEG_PARAMS = [
+    int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY,
+    int(cv2.IMWRITE_JPEG_OPTIMIZE), 0,
+    int(cv2.IMWRITE_JPEG_PROGRESSIVE), 0,
+]
+STREAM_SIZE = (640, 360)  # (width, height) of the MJPEG streams
+# Black frame shown for lanes without video, encoded once
+_BLANK_JPEG = cv2.imencode('.jpg', np.zeros((STREAM_SIZE[1], STREAM_SIZE[0], 3), dtype=np.uint8), JPEG_PARAMS)[1].tobytes()
+# multipart/x-mixed-replace framing around each JPEG part
+_MJPEG_PREFIX = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+_MJPEG_SUFFIX = b'\r\n'
+
+# Optional GPU JPEG encoding via nvJPEG (pip install pynvjpeg)
+try:
+    from nvjpeg import NvJpeg
+    nvjpeg_available = True
+except ImportError:
+    nvjpeg_available = False
+_encoder_local = threading.local()
+
+# Optional SIMD libjpeg-turbo encoding on the CPU (pip install PyTurboJPEG); cv2.imencode otherwise
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError):  # OSError: libturbojpeg shared library not found
+    _turbojpeg = None
+
+_NO_DETECTIONS = ()  # Shared, immutable "no detections" value
+
+class LaneSlot:
+    """
+    Latest published output of one lane. Values are replaced, never mutated,
+    so readers always see a complete JPEG / detections list.
+    """
+    __slots__ = ("seq", "jpeg", "detections", "_event")
+
+    def __init__(self):
+        self.seq = 0  # Incremented on every published frame
+        self.jpeg: Optional[bytes] = None
+        self.detections: Sequence[dict] = _NO_DETECTIONS
+        self._event: Optional[asyncio.Event] = None
+
+    def next_frame(self) -> asyncio.Event:
+        """Event that is set when the next frame for the lane is published."""
+        if self._event is None:
+            # Created lazily so the event belongs to the running loop
+            self._event = asyncio.Event()
+        return self._event
+
+    def publish(self, jpeg: Optional[bytes]):
+        """Store a new frame and wake every MJPEG client; later waiters get a fresh event."""
+        self.jpeg = jpeg
+        self.seq += 1
+        event, self._event = self._event, None
+        if event is not None:
+            event.set()
+
+    def clear(self):
+        self.detections = _NO_DETECTIONS
+        self.publish(None)
+
+lane_slots = {lane_id: LaneSlot() for lane_id in video_staging}
+_LANE_KEYS = tuple(f"lane{lane_id}" for lane_id in lane_slots)  # Websocket state keys, in lane_slots order
+
+# Last detection result per lane, reused while the lane's video is static
+# (see VideoStream.dirty). lane_id -> [detection result, times reused]
+MAX_RESULT_REUSE = 10  # Re-run detection after this many reuses even if static
+_last_results = {}
+# VideoStream.frame_seq of the raw frame last encoded per lane
+_streamed_seq = {}
 
 # System state tracking
 processing_started = False
@@ -65,13 +162,33 @@ async def start_system():
     # Start processing loop
     await start_processing()
 
+def load_detector() -> EmergencyDetector:
+    """
+    Load the detection model and warm it up so the first real frames aren't slow.
+    Each batch size (1 to 4 changed lanes) gets a pass, so cuDNN autotuning and
+    compilation for every shape happen here rather than mid-stream.
+    """
+    detector = EmergencyDetector()  # Loads best.pt
+    blank = np.zeros((STREAM_SIZE[1], STREAM_SIZE[0], 3), dtype=np.uint8)
+    for batch_size in range(1, len(lane_slots) + 1):
+        detector.detect_batch([blank] * batch_size)
+    return detector
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Load the model on the inference thread, off the import path
+    app.state.detector = await asyncio.get_running_loop().run_in_executor(inference_executor, load_detector)
+    print("✅ Detection model loaded and warmed up")
+
+    broadcaster_task = asyncio.create_task(state_broadcaster())
+
     # Startup - No auto-start, wait for user to upload and start
     print("🚦 Backend ready. Upload videos to all 4 lanes, then hit /simulation/start")
     
     yield
     
+    broadcaster_task.cancel()
+
     # Shutdown - stop if system was started
     global video_manager, traffic_controller
     if system_started and video_manager and traffic_controller:
@@ -88,7 +205,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _gpu_jpeg_encoder():
+    """Per-thread nvJPEG encoder, or None if GPU encoding is unavailable."""
+    global nvjpeg_available
+    if not nvjpeg_available:
+        return None
+    encoder = getattr(_encoder_local, "nvjpeg", None)
+    if encoder is None:
+        try:
+            encoder = _encoder_local.nvjpeg = NvJpeg()
+        except Exception as e:
+            log.warning("nvJPEG unavailable (%s), falling back to CPU JPEG encoding", e)
+            nvjpeg_available = False
+    return encoder
+
+def encode_jpeg(frame: np.ndarray) -> bytes:
+    encoder = _gpu_jpeg_encoder()
+    if encoder is not None:
+        return encoder.encode(frame, JPEG_QUALITY)
+    if _turbojpeg is not None:
+        return _turbojpeg.encode(frame, quality=JPEG_QUALITY, pixel_format=TJPF_BGR)
+    _, buffer = cv2.imencode('.jpg', frame, JPEG_PARAMS)
+    return buffer.tobytes()
+
+def render_lane(frame: np.ndarray, lane_result) -> bytes:
+    """Pick a lane's display frame, scale it to stream size and JPEG-encode it (runs on encode_pool)."""
+    # Show the annotated frame only when an emergency was found
+    if lane_result is not None and lane_result[0]:
+        display_frame = lane_result[1]
+    else:
+        display_frame = frame
+
+    # Streams are shown at most at STREAM_SIZE; encode fewer pixels
+    if display_frame.shape[1::-1] != STREAM_SIZE:
+        display_frame = cv2.resize(display_frame, STREAM_SIZE, interpolation=cv2.INTER_AREA)
+    return encode_jpeg(display_frame)
+
+def reusable_result(lane_id: int):
+    """Return the lane's last detection result if it may be reused for an unchanged frame, else None."""
+    cached = _last_results.get(lane_id)
+    if cached is None or cached[1] >= MAX_RESULT_REUSE:
+        return None
+    cached[1] += 1
+    return cached[0]
+
 async def processing_loop():
+    loop = asyncio.get_running_loop()
     frame_count = 0
     while True:
         # Check if system is ready
@@ -100,41 +262,70 @@ async def processing_loop():
         
         # Run detection every 3 frames to save CPU
         run_inference = (frame_count % 3 == 0)
-        current_emergency_lanes = []
+        emergency_mask = np.zeros(len(lane_slots), dtype=bool)  # index i = lane i + 1
         
+        lane_frames = []
+        lane_dirty = []
         for lane_id in [1, 2, 3, 4]:
-            frame = video_manager.get_frame(lane_id)
-            if frame is None:
-                continue
-            
-            # 1. Run inference if it's an inference frame
             if run_inference:
-                # Emergency Detection
-                has_emergency, annotated, detections = detector.detect(frame)
-                
-                # Determine display frame
-                if has_emergency:
-                    display_frame = annotated
-                    current_emergency_lanes.append(lane_id)
-                else:
-                    display_frame = frame
+                # Consumes the lane's dirty flag, so only ask on inference ticks
+                frame, dirty = video_manager.get_frame_if_dirty(lane_id)
+                _streamed_seq.pop(lane_id, None)
+            else:
+                # The loop outpaces the cameras; don't re-encode a frame that was already streamed
+                seq = video_manager.get_frame_seq(lane_id)
+                if seq == _streamed_seq.get(lane_id):
+                    continue
+                _streamed_seq[lane_id] = seq
+                frame, dirty = video_manager.get_frame(lane_id), False
+            if frame is not None:
+                lane_frames.append((lane_id, frame))
+                lane_dirty.append(dirty)
+
+        # 1. Run inference for all changed lanes in one batched forward pass
+        batch_results = [None] * len(lane_frames)
+        if run_inference:
+            to_detect = []
+            for i, (lane_id, frame) in enumerate(lane_frames):
+                if not lane_dirty[i]:
+                    batch_results[i] = reusable_result(lane_id)
+                if batch_results[i] is None:
+                    to_detect.append(i)
+
+            # Static scenes reuse every result; don't queue behind the inference thread for nothing
+            if to_detect:
+                fresh_results = await loop.run_in_executor(
+                    inference_executor, app.state.detector.detect_batch, [lane_frames[i][1] for i in to_detect]
+                )
+                for i, lane_result in zip(to_detect, fresh_results):
+                    batch_results[i] = lane_result
+                    _last_results[lane_frames[i][0]] = [lane_result, 0]
+
+        # 2. ALWAYS update the latest frame for streaming; rendering and
+        # encoding run on the pool, off the event loop
+        rendered = await asyncio.gather(
+            *(loop.run_in_executor(encode_pool, render_lane, frame, lane_result)
+              for (_, frame), lane_result in zip(lane_frames, batch_results)),
+            return_exceptions=True
+        )
+
+        for (lane_id, _), lane_result, jpeg in zip(lane_frames, batch_results, rendered):
+            slot = lane_slots[lane_id]
+            if lane_result is not None:
+                has_emergency, _, detections = lane_result
+                emergency_mask[lane_id - 1] = has_emergency
 
                 # Store detections
-                latest_detections[lane_id] = detections
-                
-            else:
-                display_frame = frame
+                slot.detections = detections
 
-            # 2. ALWAYS update the latest frame for streaming
-            try:
-                _, buffer = cv2.imencode('.jpg', display_frame)
-                latest_processed_frames[lane_id] = buffer.tobytes()
-            except Exception as e:
-                pass
+            if isinstance(jpeg, Exception):
+                log.debug("Lane %d: JPEG encode failed: %s", lane_id, jpeg)
+            else:
+                slot.publish(jpeg)
 
         # Batch Update the Controller after checking all lanes
         if run_inference:
-            traffic_controller.update_emergency_state(current_emergency_lanes)
+            traffic_controller.update_emergency_state(emergency_mask)
 
         frame_count += 1
         # Sleep slightly to maintain ~30FPS and yield control
@@ -143,68 +334,97 @@ async def processing_loop():
 # WebSocket Connection Manager
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
         print(f"New client connected. Active connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+            self.active_connections.discard(websocket)
             print(f"Client disconnected. Active connections: {len(self.active_connections)}")
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                pass
+    async def broadcast(self, message: bytes):
+        # Send to all clients concurrently so one slow client doesn't delay the rest
+        connections = list(self.active_connections)
+        results = await asyncio.gather(
+            *(connection.send_bytes(message) for connection in connections),
+            return_exceptions=True
+        )
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                self.disconnect(connection)
 
 manager = ConnectionManager()
 
-@app.websocket("/ws/emergency")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    try:
-        while True:
-            # Send updates every 100ms
+WS_HEARTBEAT_INTERVAL = 1.0  # seconds; resend unchanged state at least this often
+_last_state_payload: Optional[bytes] = None  # Last state broadcast to websocket clients
+
+async def state_broadcaster():
+    """
+    Serialize the controller state once per tick (not per client) and push it
+    to all websocket clients when it changes, plus a periodic heartbeat.
+    """
+    global _last_state_payload
+    last_sent = 0.0
+    detections = {}  # Refilled in place every tick; only read by orjson.dumps below
+    while True:
+        # Check for updates every 100ms
+        if traffic_controller is not None and manager.active_connections:
+            for key, slot in zip(_LANE_KEYS, lane_slots.values()):
+                detections[key] = slot.detections
             state = {
                 "signals": traffic_controller.get_states(),
                 "emergency": {
                     "is_active": traffic_controller.emergency_mode,
                     "lane_id": traffic_controller.emergency_lane_id
                 },
-                "detections": {
-                    f"lane{lane_id}": latest_detections.get(lane_id, [])
-                    for lane_id in [1, 2, 3, 4]
-                }
+                "detections": detections
             }
-            await websocket.send_text(json.dumps(state))
-            await asyncio.sleep(0.1)
-            # Check for client disconnect
-            # await websocket.receive_text() # This blocks, so we depend on send failing
+            payload = orjson.dumps(state)
+            now = time.monotonic()
+            if payload != _last_state_payload or now - last_sent >= WS_HEARTBEAT_INTERVAL:
+                _last_state_payload = payload
+                last_sent = now
+                await manager.broadcast(payload)
+        await asyncio.sleep(0.1)
+
+@app.websocket("/ws/emergency")
+async def websocket_endpoint(websocket: WebSocket):
+    await manager.connect(websocket)
+    try:
+        # Send the current state right away; updates come from state_broadcaster
+        if _last_state_payload is not None:
+            await websocket.send_bytes(_last_state_payload)
+        while True:
+            # Nothing is expected from the client; this just waits for it to disconnect
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
-def generate_mjpeg(lane_id):
-    blank_frame = np.zeros((360, 640, 3), dtype=np.uint8)
-    _, blank_buffer = cv2.imencode('.jpg', blank_frame)
-    blank_bytes = blank_buffer.tobytes()
-    
+async def generate_mjpeg(lane_id):
+    slot = lane_slots[lane_id]
     while True:
-        if lane_id in latest_processed_frames:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + latest_processed_frames[lane_id] + b'\r\n')
+        # Grab the event before reading so a frame published in between isn't missed
+        new_frame = slot.next_frame()
+        jpeg = slot.jpeg
+        if jpeg is not None:
+            yield b''.join((_MJPEG_PREFIX, jpeg, _MJPEG_SUFFIX))
         else:
             # Return black frame
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + blank_bytes + b'\r\n')
-        time.sleep(0.05)
+            yield b''.join((_MJPEG_PREFIX, _BLANK_JPEG, _MJPEG_SUFFIX))
+        await new_frame.wait()
 
 @app.get("/video/{lane_id}")
 async def video_feed(lane_id: int):
+    if lane_id not in lane_slots:
+        return {"status": "error", "message": "Lane ID must be 1-4"}
     return StreamingResponse(generate_mjpeg(lane_id), media_type="multipart/x-mixed-replace; boundary=frame")
 
 @app.post("/signal/{lane_id}/force")
@@ -218,6 +438,34 @@ async def simulate_emergency(lane_id: int, active: bool):
     # NOTE: Simulation disabled as it conflicts with the continuous detection loop in this version.
     return {"status": "ignored", "message": "Simulation disabled in active loop mode"}
 
+UPLOAD_COPY_BUFFER = 4 * 1024 * 1024  # bytes per read when copying uploads to disk
+
+def save_upload(src, file_path: str):
+    """Write an uploaded file to file_path, copying in the kernel when possible."""
+    try:
+        src_fd = src.fileno() if hasattr(os, "sendfile") else None
+    except (io.UnsupportedOperation, AttributeError):
+        src_fd = None  # Not backed by a real file (e.g. an in-memory buffer)
+    with open(file_path, "wb") as buffer:
+        # Uploads are spooled to a temporary file; copy it with sendfile
+        # instead of reading it through Python
+        if src_fd is not None:
+            dst_fd = buffer.fileno()
+            offset = src_start = src.tell()
+            size = os.fstat(src_fd).st_size
+            try:
+                while offset < size:
+                    sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                # e.g. macOS, where sendfile only writes to sockets: copy the rest
+                src.seek(offset)
+                buffer.seek(offset - src_start)
+        shutil.copyfileobj(src, buffer, length=UPLOAD_COPY_BUFFER)
+
 @app.post("/upload/{lane_id}")
 async def upload_video(lane_id: int, file: UploadFile = File(...)):
     """Stage a video for a lane without starting system"""
@@ -225,8 +473,7 @@ async def upload_video(lane_id: int, file: UploadFile = File(...)):
         return {"status": "error", "message": "Lane ID must be 1-4"}
     
     file_path = os.path.join(UPLOAD_DIR, f"lane{lane_id}_{file.filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    save_upload(file.file, file_path)
     
     # Stage the video
     video_staging[lane_id] = file_path
@@ -278,7 +525,7 @@ async def start_simulation(background_tasks: BackgroundTasks):
 @app.post("/simulation/reset")
 async def reset_simulation():
     """Reset the simulation and clear all staged videos"""
-    global video_manager, traffic_controller, system_started, processing_started, processing_task, video_staging
+    global video_manager, traffic_controller, system_started, processing_started, processing_task, video_staging, _last_state_payload
     
     # Stop system if running
     if system_started:
@@ -300,8 +547,11 @@ async def reset_simulation():
     video_manager = None
     traffic_controller = None
     video_staging = {1: None, 2: None, 3: None, 4: None}
-    latest_processed_frames.clear()
-    latest_detections.clear()
+    _last_state_payload = None
+    for slot in lane_slots.values():
+        slot.clear()
+    _last_results.clear()
+    _streamed_seq.clear()
     
     print("♻️ Simulation reset complete")
     
@@ -325,7 +575,7 @@ async def get_status():
 @app.delete("/videos")
 async def clear_all_videos():
     """Clear all videos and reset system state"""
-    global system_started, processing_started, lanes_with_videos, latest_processed_frames, latest_detections
+    global system_started, processing_started, lanes_with_videos
     
     # Stop everything
     video_manager.stop_all()
@@ -339,8 +589,10 @@ async def clear_all_videos():
     system_started = False
     processing_started = False
     lanes_with_videos.clear()
-    latest_processed_frames.clear()
-    latest_detections.clear()
+    for slot in lane_slots.values():
+        slot.clear()
+    _last_results.clear()
+    _streamed_seq.clear()
     
     # Clear sources.json
     try:
@@ -368,13 +620,11 @@ async def clear_video(lane_id: int):
     # Stop the stream for this lane
     video_manager.stop(lane_id)
     
-    # Remove from processed frames so it shows blank
-    if lane_id in latest_processed_frames:
-        del latest_processed_frames[lane_id]
-        
-    # Remove from detections
-    if lane_id in latest_detections:
-        del latest_detections[lane_id]
+    # Remove the processed frame and detections so it shows blank
+    if lane_id in lane_slots:
+        lane_slots[lane_id].clear()
+    _last_results.pop(lane_id, None)
+    _streamed_seq.pop(lane_id, None)
     
     # Remove from lanes_with_videos
     if lane_id in lanes_with_videos:
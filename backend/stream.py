@@ -1,10 +1,50 @@
 import cv2
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Tuple, Optional
 import numpy as np
 
+FRAME_SIZE = (640, 360)  # (width, height) every lane frame is scaled to
+
+# Hardware H.264 decode for MP4/MOV files via GStreamer (NVIDIA nvv4l2decoder),
+# scaled to FRAME_SIZE inside the pipeline
+GST_FILE_PIPELINE = (
+    "filesrc location={source} ! qtdemux ! h264parse ! nvv4l2decoder ! nvvidconv ! "
+    "video/x-raw,format=BGRx,width={width},height={height} ! videoconvert ! "
+    "video/x-raw,format=BGR ! appsink drop=true max-buffers=1"
+)
+GST_FILE_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+def _gst_quote(value: str) -> str:
+    """
+    Quote a property value for a GStreamer pipeline description. Upload paths
+    contain the client's file name, so spaces, '!' or '"' must not be able to
+    split the pipeline or add elements to it.
+    """
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _has_gstreamer() -> bool:
+    """Whether this OpenCV build was compiled with the GStreamer backend."""
+    for line in cv2.getBuildInformation().splitlines():
+        if line.strip().startswith("GStreamer:"):
+            return "YES" in line
+    return False
+
+HAS_GSTREAMER = _has_gstreamer()
+
+DEFAULT_FRAME_INTERVAL = 1 / 30  # ~30 FPS when the source doesn't report a usable FPS
+MAX_SOURCE_FPS = 120
+
 class VideoStream:
+    # Change detection: frames are compared as small grayscale thumbnails, and a
+    # lane is "dirty" once its video has moved away from the last frame handed
+    # out for inference (see read_if_dirty)
+    DIFF_SIZE = (80, 45)
+    DIFF_THRESHOLD = 2.0  # Mean absolute pixel difference that counts as a change
+    # Shown while a source can't be opened; shared, never written to
+    _BLANK_FRAME = np.zeros((360, 640, 3), dtype=np.uint8)
+
     def __init__(self, source: str, lane_id: int):
         self.source = source
         self.lane_id = lane_id
@@ -12,20 +52,50 @@ class VideoStream:
         self.current_frame: Optional[np.ndarray] = None
         self.running = False
         self.lock = threading.Lock()
+        self.small_frame: Optional[np.ndarray] = None
+        self.prev_small: Optional[np.ndarray] = None  # Thumbnail of the last frame read while dirty
+        self.dirty = True
+        self.frame_seq = 0  # Incremented for every new frame
+        self.frame_interval = DEFAULT_FRAME_INTERVAL  # Seconds per frame, from the source FPS
         # Don't initialize capture here - wait until start() is called
         
+    def _open_capture(self) -> cv2.VideoCapture:
+        """Open the source and set up buffering and frame pacing for it"""
+        cap = self._create_capture()
+        if cap.isOpened():
+            # Keep at most one decoded frame queued so slow consumers never see stale video
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            self.frame_interval = 1.0 / fps if 0 < fps <= MAX_SOURCE_FPS else DEFAULT_FRAME_INTERVAL
+        return cap
+
+    def _create_capture(self) -> cv2.VideoCapture:
+        """Open the source, using hardware-accelerated decoding (NVDEC/VAAPI/...) when available"""
+        if HAS_GSTREAMER and isinstance(self.source, str) and self.source.lower().endswith(GST_FILE_EXTENSIONS):
+            pipeline = GST_FILE_PIPELINE.format(source=_gst_quote(self.source), width=FRAME_SIZE[0], height=FRAME_SIZE[1])
+            cap = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                return cap
+        if isinstance(self.source, str) and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+            cap = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG,
+                                   [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+            if cap.isOpened():
+                return cap
+        # Webcams, older OpenCV builds, or no usable decoder: default backend
+        return cv2.VideoCapture(self.source)
+
     def _initialize_capture(self):
         """Initialize video capture with error handling"""
         try:
-            self.cap = cv2.VideoCapture(self.source)
+            self.cap = self._open_capture()
             if not self.cap.isOpened():
                 print(f"Lane {self.lane_id}: Failed to open video source: {self.source}")
                 # Create blank frame as fallback
-                self.current_frame = np.zeros((360, 640, 3), dtype=np.uint8)
+                self.current_frame = VideoStream._BLANK_FRAME
         except Exception as e:
             print(f"Lane {self.lane_id}: Error initializing capture: {e}")
             self.cap = None
-            self.current_frame = np.zeros((360, 640, 3), dtype=np.uint8)
+            self.current_frame = VideoStream._BLANK_FRAME
         
     def start(self):
         if self.running:
@@ -42,16 +112,18 @@ class VideoStream:
             self.cap.release()
 
     def _update(self):
+        next_frame_time = time.monotonic()
         while self.running:
             if not self.cap or not self.cap.isOpened():
                 # Try to reconnect or loop video if it's a file
                 try:
-                    self.cap = cv2.VideoCapture(self.source)
+                    self.cap = self._open_capture()
                     if not self.cap.isOpened():
                         print(f"Lane {self.lane_id}: Cannot open source {self.source}, using blank frame")
                         # Use blank frame
                         with self.lock:
-                            self.current_frame = np.zeros((360, 640, 3), dtype=np.uint8)
+                            self.current_frame = VideoStream._BLANK_FRAME
+                            self.frame_seq += 1
                         time.sleep(2)
                         continue
                 except Exception as e:
@@ -65,24 +137,57 @@ class VideoStream:
                      print(f"Lane {self.lane_id}: Failed to read from Webcam.")
                      time.sleep(2)
                      continue
-                # End of file, loop
-                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                # End of file, loop. Pipelines that can't seek are reopened instead.
+                if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                    self.cap.release()
                 continue
             
             # Resize frame here to save bandwidth and processing
             try:
                 if frame is not None and frame.size > 0:
-                    frame = cv2.resize(frame, (640, 360))
+                    if frame.shape[1::-1] != FRAME_SIZE:  # GStreamer pipelines already scale
+                        frame = cv2.resize(frame, FRAME_SIZE)
+                    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), self.DIFF_SIZE,
+                                       interpolation=cv2.INTER_AREA)
                     with self.lock:
                         self.current_frame = frame
+                        self.small_frame = small
+                        self.frame_seq += 1
+                        if not self.dirty:
+                            self.dirty = (self.prev_small is None or
+                                          cv2.absdiff(small, self.prev_small).mean() > self.DIFF_THRESHOLD)
             except Exception as e:
                 print(f"Error processing frame for Lane {self.lane_id}: {e}")
             
-            time.sleep(0.03) # ~30 FPS
+            # Pace to the source FPS against a deadline, so decode time doesn't add drift
+            next_frame_time += self.frame_interval
+            delay = next_frame_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame_time = time.monotonic()  # Running late; don't try to catch up
 
     def read(self) -> Optional[np.ndarray]:
+        """
+        Return the latest frame without copying it. Every decoded frame is a
+        new array that is published by swapping the reference, so it is never
+        written to afterwards; callers must not modify it either.
+        """
+        return self.current_frame
+
+    def read_if_dirty(self) -> Tuple[Optional[np.ndarray], bool]:
+        """
+        Like read() (the frame is shared, don't modify it), but also report whether the video changed noticeably since
+        the last frame returned as dirty. Clears the flag.
+        """
         with self.lock:
-            return self.current_frame.copy() if self.current_frame is not None else None
+            if self.current_frame is None:
+                return None, False
+            dirty = self.dirty
+            if dirty:
+                self.prev_small = self.small_frame
+                self.dirty = False
+            return self.current_frame, dirty
 
 class VideoManager:
     def __init__(self, sources: Dict[int, str]):
@@ -92,6 +197,12 @@ class VideoManager:
             self.streams[lane_id] = stream
             
     def start_all(self):
+        # Open all sources concurrently (container probing and decoder setup
+        # take a while per file), then start the reader threads
+        pending = [stream for stream in self.streams.values() if stream.cap is None and not stream.running]
+        if len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                list(pool.map(VideoStream._initialize_capture, pending))
         for stream in self.streams.values():
             stream.start()
             
@@ -126,3 +237,13 @@ class VideoManager:
         if lane_id in self.streams:
             return self.streams[lane_id].read()
         return None
+
+    def get_frame_seq(self, lane_id: int) -> Optional[int]:
+        if lane_id in self.streams:
+            return self.streams[lane_id].frame_seq
+        return None
+
+    def get_frame_if_dirty(self, lane_id: int) -> Tuple[Optional[np.ndarray], bool]:
+        if lane_id in self.streams:
+            return self.streams[lane_id].read_if_dirty()
+        return None, False
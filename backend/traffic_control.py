@@ -1,63 +1,167 @@
 import asyncio
+import logging
 import time
 from enum import Enum
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Protocol, Set, Tuple, Union
+
+import numpy as np
+
+log = logging.getLogger(__name__)
 
 class SignalState(Enum):
     RED = "RED"
     YELLOW = "YELLOW"
     GREEN = "GREEN"
 
-class LaneState:
-    def __init__(self, lane_id: int):
-        self.lane_id = lane_id
-        self.state = SignalState.RED
+class ControlMode(Enum):
+    NORMAL = "NORMAL"           # Fixed-time cycle through all lanes
+    EMERGENCY = "EMERGENCY"     # One lane with an emergency vehicle is held green
+    ROUND_ROBIN = "ROUND_ROBIN" # Several emergency lanes take turns
+
+# Per-lane signal codes, packed two bits per lane into TrafficController._state_word
+RED, YELLOW, GREEN = 0, 1, 2
+_STATE_NAMES = ("RED", "YELLOW", "GREEN")
+_STATE_BY_CODE = (SignalState.RED, SignalState.YELLOW, SignalState.GREEN)
+
+def _lowest_bit(mask: int) -> int:
+    """Index of the lowest set bit of a non-zero lane bitmask."""
+    return (mask & -mask).bit_length() - 1
+
+def _lane_indices(bits: int):
+    """Yield the lane index of each set bit in a state-word mask (bit 2*i for lane i)."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1 >> 1
+        bits ^= low
 
 # --- HARDWARE INTERFACE ---
-class HardwareInterface:
-    def __init__(self):
-        # Initialize Serial or GPIO here
-        # import serial
-        # self.ser = serial.Serial('COM3', 9600)
-        pass
+class HardwareInterface(Protocol):
+    def send_update(self, lane_id: int, state: SignalState):
+        """Send signal change to physical hardware."""
+        ...
+
+    def send_batch(self, updates: List[Tuple[int, SignalState]]):
+        """Send several signal changes that belong to one transition as a single frame."""
+        ...
+
+class NullHardware:
+    """No physical signals attached: log the changes instead (simulation and tests)."""
 
     def send_update(self, lane_id: int, state: SignalState):
-        """
-        Send signal change to physical hardware.
-        """
-        # Example Serial Command:
-        # command = f"L{lane_id}:{state.value}\n"
-        # self.ser.write(command.encode())
-        
-        # For now, we simulate it by printing
-        print(f"🔌 [HARDWARE OUT] Lane {lane_id} switched to {state.value}")
+        log.info("🔌 [HARDWARE OUT] Lane %d switched to %s", lane_id, state.value)
+
+    def send_batch(self, updates: List[Tuple[int, SignalState]]):
+        for lane_id, state in updates:
+            log.info("🔌 [HARDWARE OUT] Lane %d switched to %s", lane_id, state.value)
+
+class SerialHardware:
+    """
+    Signal controller on a serial port, driven with text commands such as
+    "L1:RED\n" (one lane) or "L1:RED;L2:GREEN\n" (one transition).
+    """
+
+    def __init__(self, port: str = "COM3", baudrate: int = 9600, num_lanes: int = 4):
+        # pyserial is only needed when real hardware is attached
+        import serial
+        self.ser = serial.Serial(port, baudrate)
+        self._write_errors = (serial.SerialException, OSError)
+        # Every command is encoded once up front: (lane_id, state) -> b"L1:RED"
+        self._fields = {
+            (lane_id, state): f"L{lane_id}:{state.value}".encode()
+            for lane_id in range(1, num_lanes + 1) for state in SignalState
+        }
+        self._commands = {key: field + b"\n" for key, field in self._fields.items()}
+
+    def send_update(self, lane_id: int, state: SignalState):
+        self._write(self._commands[(lane_id, state)])
+
+    def send_batch(self, updates: List[Tuple[int, SignalState]]):
+        fields = self._fields
+        self._write(b";".join([fields[update] for update in updates]) + b"\n")
+
+    def _write(self, command: bytes):
+        try:
+            self.ser.write(command)
+        except self._write_errors as e:
+            # A lost link must not take down the control loop
+            log.error("⚠️ Signal hardware write failed: %s", e)
 # --------------------------
 
 class TrafficController:
-    def __init__(self, num_lanes: int = 4):
-        self.lanes = [LaneState(i) for i in range(1, num_lanes + 1)]
-        self.hardware = HardwareInterface() # Initialize hardware
+    # Fixed attribute set: cheaper lookups in the control loop, and a typo'd
+    # assignment raises instead of silently adding a new attribute
+    __slots__ = (
+        "lane_ids", "_lane_index", "_state_word", "_low_bits", "_current_green",
+        "_pending_updates", "_lane_keys", "_states_out", "_states_dirty",
+        "hardware", "current_green_lane_index",
+        "emergency_mode", "_active_mask", "emergency_lane_id", "_pending_emergency",
+        "_mode", "_handlers",
+        "yellow_duration", "green_duration",
+        "running", "_clock", "last_switch_time", "loop_task", "_lock", "_wake",
+        "_transition_cond", "_flip_target", "_yellow_until",
+    )
+
+    def __init__(self, num_lanes: int = 4, hardware: Optional[HardwareInterface] = None):
+        # Signal state of lane_ids[i] is the code in bits 2*i..2*i+1 of _state_word
+        self.lane_ids = tuple(range(1, num_lanes + 1))
+        self._lane_index = {lane_id: i for i, lane_id in enumerate(self.lane_ids)}
+        self._state_word = 0 # All RED
+        self._low_bits = sum(1 << 2 * i for i in range(num_lanes)) # Low bit of every lane's code
+        self._current_green: Optional[int] = None # Index of the lane that is GREEN, if any
+        self._pending_updates: List[Tuple[int, SignalState]] = [] # Changes not yet sent to the hardware
+        self._lane_keys = tuple(f"lane{lane_id}" for lane_id in self.lane_ids)
+        self._states_out: Dict[str, str] = {}
+        self._states_dirty = True # _states_out needs refreshing from _state_word
+        self.hardware = hardware if hardware is not None else NullHardware() # Initialize hardware
         self.current_green_lane_index = 0
         
         # Emergency Logic
         self.emergency_mode = False
-        self.active_emergency_lanes: List[int] = [] # List of lanes demanding priority
+        self._active_mask = 0 # Lanes demanding priority: bit i set for lane_ids[i]
         self.emergency_lane_id: Optional[int] = None # The specific lane currently given Green (for compatibility & focus)
+        self._pending_emergency: Optional[int] = None # Latest bitmask not yet applied
+        self._mode = ControlMode.NORMAL
+        self._handlers = {
+            ControlMode.NORMAL: self._run_normal,
+            ControlMode.EMERGENCY: self._run_single_emergency,
+            ControlMode.ROUND_ROBIN: self._run_round_robin,
+        }
         
         self.yellow_duration = 2 # Safety transition time
         self.green_duration = 10 # seconds for normal cycle & priority round robin
         
         self.running = False
+        # Monotonic clock for all phase timing; the event loop's clock once started
+        self._clock = time.monotonic
         self.last_switch_time = 0.0
         self.loop_task = None
         self._lock = asyncio.Lock()
+        self._wake: Optional[asyncio.Event] = None # Set to make the control loop re-evaluate right away
+        # Notified (under _lock) after every batch of signal changes, for observers such as tests
+        self._transition_cond: Optional[asyncio.Condition] = None
+        self._flip_target: Optional[int] = None # Lane index to turn GREEN once the yellow clearance ends
+        self._yellow_until = 0.0 # When the lanes currently YELLOW may turn RED
 
     async def start(self):
         self.running = True
-        # Start with lane 1 Green
-        self.set_lane_green(1)
-        self.last_switch_time = time.time()
+        self._clock = asyncio.get_running_loop().time
+        self._wake = asyncio.Event()
+        self._transition_cond = asyncio.Condition(self._lock)
+        async with self._lock:
+            # Start with lane 1 Green
+            self.set_lane_green(1)
+        self.last_switch_time = self._clock()
         self.loop_task = asyncio.create_task(self._control_loop())
+        self.loop_task.add_done_callback(self._on_loop_done)
+
+    def _on_loop_done(self, task: asyncio.Task):
+        """Report a crashed control loop as soon as it happens, not at shutdown."""
+        if task.cancelled() or task.exception() is None:
+            return
+        # The signals stay frozen on their last state from here on
+        self.running = False
+        log.error("❌ Traffic control loop crashed; signals are no longer switching",
+                  exc_info=task.exception())
 
     async def stop(self):
         self.running = False
@@ -67,161 +171,291 @@ class TrafficController:
                 await self.loop_task
             except asyncio.CancelledError:
                 pass
+            except Exception as e:
+                # Already reported by _on_loop_done; don't fail the caller's teardown
+                log.error("Traffic control loop had stopped with an error: %r", e)
 
     def get_states(self) -> Dict[str, str]:
-        return {f"lane{lane.lane_id}": lane.state.value for lane in self.lanes}
+        # The returned dict is reused between calls; copy it if you need to keep it.
+        # It is only refreshed after a signal change.
+        out = self._states_out
+        if self._states_dirty:
+            word = self._state_word
+            for key in self._lane_keys:
+                out[key] = _STATE_NAMES[word & 3]
+                word >>= 2
+            self._states_dirty = False
+        return out
+
+    @property
+    def active_emergency_lanes(self) -> List[int]:
+        """IDs of the lanes demanding priority, sorted."""
+        return [lane_id for i, lane_id in enumerate(self.lane_ids) if self._active_mask >> i & 1]
+
+    def get_green_lane(self) -> Optional[int]:
+        """ID of the lane currently showing GREEN, or None during a transition."""
+        return None if self._current_green is None else self.lane_ids[self._current_green]
+
+    def _set_state(self, index: int, code: int):
+        # The hardware is updated in _flush_updates, once per transition step
+        shift = 2 * index
+        self._state_word = self._state_word & ~(3 << shift) | code << shift
+        self._states_dirty = True
+        if code == GREEN:
+            self._current_green = index
+        elif index == self._current_green:
+            self._current_green = None
+        self._pending_updates.append((self.lane_ids[index], _STATE_BY_CODE[code]))
+
+    def _yellow_bits(self) -> int:
+        # Code 01: low bit set, high bit clear
+        word = self._state_word
+        return word & ~(word >> 1) & self._low_bits
+
+    def _non_red_bits(self) -> int:
+        word = self._state_word
+        return (word | word >> 1) & self._low_bits
+
+    def _flush_updates(self):
+        """
+        Send the signal changes made since the last flush as one hardware frame.
+        Must be called with _lock held, so _transition_cond waiters can be notified.
+        """
+        if self._pending_updates:
+            updates, self._pending_updates = self._pending_updates, []
+            self.hardware.send_batch(updates)
+            if self._transition_cond is not None:
+                self._transition_cond.notify_all()
+
+    def update_emergency_state(self, emergency: Union[np.ndarray, List[int]]):
+        """
+        Update the lanes checking for emergencies, given as a bool mask over
+        the lanes (in lane_ids order) or as a list of lane IDs.
+        Updates arriving in the same event loop iteration are coalesced and
+        only the latest one is applied.
+        """
+        # Kept as an int bitmask, so the caller is free to reuse its mask or list
+        mask = 0
+        if isinstance(emergency, np.ndarray):
+            for i in np.flatnonzero(emergency).tolist():
+                mask |= 1 << i
+        else:
+            for lane_id in emergency:
+                mask |= 1 << self._lane_index[lane_id]
+        scheduled = self._pending_emergency is not None
+        self._pending_emergency = mask
+        if scheduled:
+            return
+        try:
+            asyncio.get_running_loop().call_soon(self._apply_emergency_state)
+        except RuntimeError: # No event loop (synchronous caller): apply right away
+            self._apply_emergency_state()
 
-    def update_emergency_state(self, lane_ids: List[int]):
+    def _apply_emergency_state(self):
         """
-        Update the list of lanes checking for emergencies.
+        Apply the latest emergency mask.
         Handle state transitions (Normal -> Emergency) here if needed,
         but main logic is in the control loop.
         """
-        self.active_emergency_lanes = lane_ids
+        mask, self._pending_emergency = self._pending_emergency, None
+        if mask is None:
+            return
+        # Detection reports every few frames; nothing to do if the picture is unchanged
+        if mask == self._active_mask:
+            return
+        self._active_mask = mask
+        # mask & (mask - 1) clears the lowest bit: zero when only one lane is set
+        self._mode = (ControlMode.NORMAL if not mask else
+                      ControlMode.EMERGENCY if not mask & (mask - 1) else ControlMode.ROUND_ROBIN)
         
-        if len(self.active_emergency_lanes) > 0:
+        if mask:
             if not self.emergency_mode:
-                print(f"🚨 Emergency detected in Lanes {self.active_emergency_lanes}. Entering Emergency Mode.")
+                log.info("🚨 Emergency detected in Lanes %s. Entering Emergency Mode.", self.active_emergency_lanes)
                 self.emergency_mode = True
                 # Reset switch time to valid immediate action
-                self.last_switch_time = 0 
+                self.last_switch_time = float("-inf")
         else:
             if self.emergency_mode:
-                print("✅ Emergency cleared. Resuming normal operation.")
+                log.info("✅ Emergency cleared. Resuming normal operation.")
                 self.emergency_mode = False
                 self.emergency_lane_id = None
-                self.last_switch_time = time.time() # Reset for normal cycle
+                self.last_switch_time = self._clock() # Reset for normal cycle
+        self._notify()
+
+    def _notify(self):
+        """Wake the control loop early (state changed outside of it)."""
+        if self._wake is not None:
+            self._wake.set()
 
     async def _control_loop(self):
         while self.running:
-            try:
-                async with self._lock:
-                    now = time.time()
-                    
-                    # --- STATE 0: No Emergency ---
-                    if not self.emergency_mode:
-                        # Normal Cycle
-                        if now - self.last_switch_time >= self.green_duration:
-                            await self._cycle_next_lane()
-
-                    # --- Emergency Handling ---
-                    else:
-                        count = len(self.active_emergency_lanes)
-                        
-                        # --- STATE 1: Single Emergency ---
-                        if count == 1:
-                            target = self.active_emergency_lanes[0]
-                            # Create sticky behavior
-                            if self.emergency_lane_id != target:
-                                self.emergency_lane_id = target
-                                await self._ensure_lane_green(target)
-                            else:
-                                # Ensure it stays green (refresh if needed, though _ensure handles checks)
-                                await self._ensure_lane_green(target)
-                        
-                        # --- STATE 2: Multi-Emergency Conflict (Round-Robin) ---
-                        elif count > 1:
-                            sorted_lanes = sorted(self.active_emergency_lanes)
-                            
-                            # If we don't have a valid emergency target yet (or it disappeared)
-                            if self.emergency_lane_id not in sorted_lanes:
-                                # Pick the first available
-                                self.emergency_lane_id = sorted_lanes[0]
-                                print(f"🚨 Multi-Emergency: Starting Round Robin with Lane {self.emergency_lane_id}")
-                                await self._ensure_lane_green(self.emergency_lane_id)
-                                self.last_switch_time = time.time()
-                            
-                            # If we have a target, check if its time is up
-                            elif now - self.last_switch_time >= self.green_duration:
-                                # Switch to next
-                                current_idx = sorted_lanes.index(self.emergency_lane_id)
-                                next_idx = (current_idx + 1) % len(sorted_lanes)
-                                next_lane = sorted_lanes[next_idx]
-                                
-                                print(f"🚨 Multi-Emergency: Time up. Switching to Lane {next_lane}")
-                                self.emergency_lane_id = next_lane
-                                await self._ensure_lane_green(next_lane)
-                                self.last_switch_time = time.time()
-                            
-                            else:
-                                # Keep current green
-                                await self._ensure_lane_green(self.emergency_lane_id)
+            async with self._lock:
+                now = self._clock()
+                if self._flip_target is not None:
+                    self._redirect_clearance()
+                    # Finish a yellow clearance whose time is up
+                    if now >= self._yellow_until:
+                        self._finish_switch(now)
+                        # Send the new GREEN before the mode logic can act on it, so
+                        # one hardware frame never carries GREEN and YELLOW for a lane
+                        self._flush_updates()
+                # Mode logic is paused while a clearance is in progress
+                if self._flip_target is None:
+                    timeout = self._handlers[self._mode](now)
+                if self._flip_target is not None:
+                    timeout = self._yellow_until - now
+                self._flush_updates()
 
-            except Exception as e:
-                print(f"Error in traffic control loop: {e}")
-                
-            await asyncio.sleep(0.1)
+            # Sleep until the next phase deadline or until woken by an update
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
 
-    async def _ensure_lane_green(self, target_lane_id: int):
+    def _redirect_clearance(self):
         """
-        Safely switches signals to make target_lane_id GREEN.
-        Includes Yellow clearance if switching from another Green lane.
+        An emergency arrived during a yellow clearance: point the pending flip
+        at an emergency lane, instead of turning another lane GREEN only to
+        clear it again right after.
         """
-        target_lane = next((l for l in self.lanes if l.lane_id == target_lane_id), None)
-        if not target_lane: return
-
-        # If already Green, ensure others are Red (sanity check)
-        if target_lane.state == SignalState.GREEN:
-            for lane in self.lanes:
-                if lane.lane_id != target_lane_id and lane.state != SignalState.RED:
-                    lane.state = SignalState.RED
-                    self.hardware.send_update(lane.lane_id, lane.state)
+        mask = self._active_mask
+        if not mask or mask >> self._flip_target & 1:
             return
+        current = self._lane_index.get(self.emergency_lane_id)
+        target = current if current is not None and mask >> current & 1 else _lowest_bit(mask)
+        self.emergency_lane_id = self.lane_ids[target]
+        self._ensure_lane_green(self.emergency_lane_id)
 
-        # Perform Switch
-        print(f"🚦 Switching Signal Priority to Lane {target_lane_id}...")
-        
-        # 1. Turn active GREEN lane to YELLOW -> wait -> RED
-        for lane in self.lanes:
-            if lane.state == SignalState.GREEN:
-                lane.state = SignalState.YELLOW
-                self.hardware.send_update(lane.lane_id, lane.state)
-                # We are holding the lock, so this pause is safe for state consistency
-                await asyncio.sleep(self.yellow_duration)
-                
-                lane.state = SignalState.RED
-                self.hardware.send_update(lane.lane_id, lane.state)
+    # --- Mode handlers: act for the current mode, return seconds until the next deadline ---
+
+    def _run_normal(self, now: float) -> float:
+        # --- STATE 0: No Emergency ---
+        # Normal Cycle
+        if now - self.last_switch_time >= self.green_duration:
+            # Restarts the green timer once the next lane is green
+            self._cycle_next_lane(now)
+            return self.green_duration
+        return self.last_switch_time + self.green_duration - now
+
+    def _run_single_emergency(self, now: float) -> float:
+        # --- STATE 1: Single Emergency ---
+        # Create sticky behavior; _ensure_lane_green is a no-op while it stays green
+        self.emergency_lane_id = self.lane_ids[_lowest_bit(self._active_mask)]
+        self._ensure_lane_green(self.emergency_lane_id)
+        # Holding a single lane green has no deadline; just re-check it now and then
+        return self.green_duration
+
+    def _run_round_robin(self, now: float) -> float:
+        # --- STATE 2: Multi-Emergency Conflict (Round-Robin) ---
+        mask = self._active_mask
+        current_idx = self._lane_index.get(self.emergency_lane_id)
         
-        # 2. Turn Target to GREEN
-        target_lane.state = SignalState.GREEN
-        self.hardware.send_update(target_lane.lane_id, target_lane.state)
+        # If we don't have a valid emergency target yet (or it disappeared)
+        if current_idx is None or not mask >> current_idx & 1:
+            # Pick the first available
+            self.emergency_lane_id = self.lane_ids[_lowest_bit(mask)]
+            log.info("🚨 Multi-Emergency: Starting Round Robin with Lane %d", self.emergency_lane_id)
+            if self._ensure_lane_green(self.emergency_lane_id):
+                self.last_switch_time = now
+            return self.green_duration
         
-        # Sync index for normal cycle restoration logic
-        self.current_green_lane_index = target_lane_id - 1
-
-    async def _cycle_next_lane(self):
-        # Current Green -> Yellow -> Red
-        current_lane = self.lanes[self.current_green_lane_index]
-        if current_lane.state == SignalState.GREEN:
-            current_lane.state = SignalState.YELLOW
-            self.hardware.send_update(current_lane.lane_id, current_lane.state)
-            
-            await asyncio.sleep(self.yellow_duration)
+        # If we have a target, check if its time is up
+        elif now - self.last_switch_time >= self.green_duration:
+            # Switch to next
+            # Next active lane above the current one, wrapping to the lowest
+            later = mask >> (current_idx + 1) << (current_idx + 1)
+            next_lane = self.lane_ids[_lowest_bit(later or mask)]
             
-            current_lane.state = SignalState.RED
-            self.hardware.send_update(current_lane.lane_id, current_lane.state)
+            log.info("🚨 Multi-Emergency: Time up. Switching to Lane %d", next_lane)
+            self.emergency_lane_id = next_lane
+            if self._ensure_lane_green(next_lane):
+                self.last_switch_time = now
+            return self.green_duration
         
-        # Next Lane
-        self.current_green_lane_index = (self.current_green_lane_index + 1) % len(self.lanes)
-        next_lane = self.lanes[self.current_green_lane_index]
-        next_lane.state = SignalState.GREEN
-        self.hardware.send_update(next_lane.lane_id, next_lane.state)
+        # Keep current green
+        self._ensure_lane_green(self.emergency_lane_id)
+        return self.last_switch_time + self.green_duration - now
+
+    def _ensure_lane_green(self, target_lane_id: int) -> bool:
+        """
+        Safely switches signals to make target_lane_id GREEN.
+        Includes Yellow clearance if switching from another Green lane; the
+        target then turns GREEN from the control loop when the clearance ends.
+        Returns True if the target is already GREEN (no clearance needed).
+        """
+        target = self._lane_index.get(target_lane_id)
+        if target is None: return False
+
+        # A clearance is already running: redirect it, keeping its deadline
+        if self._flip_target is not None:
+            if self._flip_target != target:
+                log.info("🚦 Switching Signal Priority to Lane %d...", target_lane_id)
+                self._flip_target = target
+            return False
+
+        # If already Green, ensure others are Red (sanity check; a single
+        # compare of the state word unless a switch was interrupted)
+        if self._current_green == target:
+            non_red = self._non_red_bits()
+            if non_red != 1 << 2 * target:
+                for i in _lane_indices(non_red):
+                    if i != target:
+                        self._set_state(i, RED)
+            return True
+
+        # Perform Switch
+        log.info("🚦 Switching Signal Priority to Lane %d...", target_lane_id)
+        self._start_switch(target, self._clock())
+        return False
+
+    def _start_switch(self, target: int, now: float):
+        """
+        Turn the GREEN lane YELLOW and schedule target to turn GREEN when the
+        yellow clearance ends (see _finish_switch). With no GREEN lane to
+        clear, target turns GREEN right away.
+        """
+        self._flip_target = target
+        if self._current_green is not None:
+            self._set_state(self._current_green, YELLOW)
+            self._yellow_until = now + self.yellow_duration
+            self._notify() # Let the control loop wait for the new deadline
+        elif not self._yellow_bits():
+            self._finish_switch(now)
+
+    def _finish_switch(self, now: float):
+        """End the yellow clearance: YELLOW lanes go RED and the target goes GREEN."""
+        target, self._flip_target = self._flip_target, None
+        for i in _lane_indices(self._yellow_bits()):
+            self._set_state(i, RED)
+        self._set_state(target, GREEN)
         
-        self.last_switch_time = time.time()
+        # Sync index for normal cycle restoration logic
+        self.current_green_lane_index = target
+        self.last_switch_time = now
+
+    def _cycle_next_lane(self, now: float):
+        # Current Green -> Yellow -> Red, then the next lane goes Green
+        self._start_switch((self.current_green_lane_index + 1) % len(self.lane_ids), now)
             
     def set_lane_green(self, lane_id: int):
-        # Synchronous override
-        for i, lane in enumerate(self.lanes):
-            if lane.lane_id == lane_id:
-                lane.state = SignalState.GREEN
+        # Synchronous override; abandons any clearance in progress.
+        # Call with _lock held once the controller has been started.
+        self._flip_target = None
+        target = self._lane_index.get(lane_id)
+        for i in range(len(self.lane_ids)):
+            if i == target:
+                self._set_state(i, GREEN)
                 self.current_green_lane_index = i
             else:
-                lane.state = SignalState.RED
-            self.hardware.send_update(lane.lane_id, lane.state)
-        self.last_switch_time = time.time()
+                self._set_state(i, RED)
+        self._flush_updates()
+        self.last_switch_time = self._clock()
 
     async def force_green(self, lane_id: int):
         """Manually force a lane to green (User override)."""
         async with self._lock:
-            await self._ensure_lane_green(lane_id)
-            self.last_switch_time = time.time()
+            if self._ensure_lane_green(lane_id):
+                self.last_switch_time = self._clock()
+            self._flush_updates()
+        self._notify()
@@ -21,6 +21,8 @@ interface SocketData {
   detections: Record<string, Array<{ class: string; confidence: number }>>;
 }
 
+const decoder = new TextDecoder();
+
 export const useSocket = (url: string) => {
   const [data, setData] = useState<SocketData | null>(null);
   const [isConnected, setIsConnected] = useState(false);
@@ -29,6 +31,8 @@ export const useSocket = (url: string) => {
   useEffect(() => {
     const connect = () => {
       const socket = new WebSocket(url);
+      // State arrives as binary frames of UTF-8 JSON
+      socket.binaryType = 'arraybuffer';
       socketRef.current = socket;
 
       socket.onopen = () => {
@@ -38,7 +42,8 @@ export const useSocket = (url: string) => {
 
       socket.onmessage = (event) => {
         try {
-          const parsedData = JSON.parse(event.data);
+          const text = typeof event.data === 'string' ? event.data : decoder.decode(event.data);
+          const parsedData = JSON.parse(text);
           setData(parsedData);
         } catch (err) {
           console.error('Failed to parse WS message', err);